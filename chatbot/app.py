@@ -5,9 +5,16 @@ This module provides a user-friendly web interface for interacting with the chat
 
 import streamlit as st
 from model import AIChat
+from collections import deque
+import html
 import time
 import sys
 
+# Bound the stored history and only re-render a tail window of it on each
+# Streamlit rerun; re-rendering every message dominates server CPU on long chats
+MAX_STORED_MESSAGES = 50
+MAX_RENDERED_MESSAGES = 20
+
 # Page configuration with improved styling
 st.set_page_config(
     page_title="AI Chatbot",
@@ -51,22 +58,55 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-def initialize_session_state():
+@st.cache_resource
+def get_chatbot(quant):
+    """
+    Load the model once per quantization setting and share it across all
+    sessions and reruns. Without this every browser session would load its
+    own copy of the full model weights into RAM/VRAM.
+    """
+    return AIChat(quant=quant)
+
+def initialize_session_state(quant):
     """
     Initialize session state variables for the Streamlit app.
-    Creates a new chatbot instance and message history if they don't exist.
+    Attaches the shared chatbot for the chosen quantization and creates
+    this session's own conversation state and message history.
     """
-    if "chatbot" not in st.session_state:
-        st.session_state.chatbot = AIChat()
+    chatbot = get_chatbot(quant)
+    if st.session_state.get("chatbot") is not chatbot:
+        # First run, or the quantization changed: conversations can't carry
+        # over between different model instances
+        st.session_state.chatbot = chatbot
+        st.session_state.chat_session = chatbot.new_session()
     if "messages" not in st.session_state:
-        st.session_state.messages = []
+        # Each entry is a (role, escaped_text) tuple; the deque drops the
+        # oldest messages once the cap is reached
+        st.session_state.messages = deque(maxlen=MAX_STORED_MESSAGES)
 
 def main():
     """
     Main function to run the Streamlit app.
     Sets up the user interface, handles chat interactions, and manages the chat history.
     """
-    initialize_session_state()
+    # Add a settings sidebar; the model settings have to be read before the
+    # (cached) model is created below
+    with st.sidebar:
+        st.header("⚙️ Chat Settings")
+        quant = st.selectbox("Quantization", ["int8", "gptq4", "none"],
+                           help="Weight quantization on GPU: smaller weights decode faster")
+        temperature = st.slider("Response Creativity", 0.0, 1.0, 0.7,
+                              help="Higher values make responses more creative but less focused")
+        max_length = st.slider("Maximum Response Length", 100, 1000, 500,
+                             help="Maximum number of tokens in the response")
+        deterministic = st.checkbox("Deterministic responses",
+                                  help="Repeatable replies; identical prompts are answered instantly from cache")
+
+        st.header("🎨 Theme")
+        theme = st.selectbox("Select Theme", ["Dark", "Light"],
+                           help="Choose the chat interface theme")
+
+    initialize_session_state(quant)
 
     # Set up the header and welcome message with improved styling
     col1, col2 = st.columns([1, 4])
@@ -84,43 +124,34 @@ def main():
         </div>
         """, unsafe_allow_html=True)
     
-    # Add a settings sidebar
-    with st.sidebar:
-        st.header("⚙️ Chat Settings")
-        temperature = st.slider("Response Creativity", 0.0, 1.0, 0.7, 
-                              help="Higher values make responses more creative but less focused")
-        max_length = st.slider("Maximum Response Length", 100, 1000, 500, 
-                             help="Maximum number of tokens in the response")
-        
-        st.header("🎨 Theme")
-        theme = st.selectbox("Select Theme", ["Dark", "Light"], 
-                           help="Choose the chat interface theme")
-
-    # Display chat history - shows all previous messages in the conversation
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.write(message["content"])
+    # Display chat history - only the most recent window, with the text
+    # already escaped so the markdown parser isn't re-run on every rerun
+    for role, content in list(st.session_state.messages)[-MAX_RENDERED_MESSAGES:]:
+        with st.chat_message(role):
+            st.markdown(content)
 
     # Handle new user input
     if prompt := st.chat_input("What would you like to talk about?"):
-        # Store and display the user's message
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        # Store and display the user's message (escaped once, up front)
+        escaped_prompt = html.escape(prompt)
+        st.session_state.messages.append(("user", escaped_prompt))
         with st.chat_message("user"):
-            st.write(prompt)
+            st.markdown(escaped_prompt)
 
-        # Generate the AI response using our chatbot model
+        # Generate the AI response using our chatbot model, streaming tokens
+        # to the page as they are decoded instead of blocking until the end
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):  # Show a loading spinner while generating
-                response = st.session_state.chatbot.generate_response(prompt)
-                st.write(response)  # Display the generated response
+            response = st.write_stream(st.session_state.chatbot.stream_response(
+                prompt, st.session_state.chat_session, deterministic=deterministic))
+            escaped_response = html.escape(response)
         # Store the assistant's response in chat history
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        st.session_state.messages.append(("assistant", escaped_response))
 
     # Provide a button to reset/clear the conversation
     if st.button("Reset Chat"):
-        st.session_state.chatbot.reset_chat()  # Clear the model's conversation memory
-        st.session_state.messages = []  # Clear the displayed chat history
-        st.experimental_rerun()  # Refresh the page to show the clean state
+        st.session_state.chat_session.reset()  # Clear this conversation's memory
+        st.session_state.messages.clear()  # Clear the displayed chat history
+        st.rerun()  # Refresh the page to show the clean state
 
 if __name__ == "__main__":
     main()